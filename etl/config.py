@@ -2,17 +2,28 @@
 Configuration management module for ETL process
 Handles loading and parsing configuration files
 """
+import copy
 import os
 import logging
+from functools import lru_cache
 import yaml
 from sqlalchemy import create_engine, MetaData
 
+# libyaml's C parser when available, the pure-Python one otherwise
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 logger = logging.getLogger(__name__)
 
 def load_yaml_file(file_path):
     """
     Load a YAML file and return its contents as a dictionary
     
+    Parsed files are cached per path and modification time; callers get
+    their own copy, so adding keys to the result does not touch the cache.
+    
     Args:
         file_path (str): Path to the YAML file
         
@@ -20,12 +31,26 @@ def load_yaml_file(file_path):
         dict: Contents of the YAML file
     """
     try:
-        with open(file_path, 'r') as file:
-            return yaml.safe_load(file)
+        return copy.deepcopy(parse_yaml_file(file_path, os.path.getmtime(file_path)))
     except Exception as e:
         logger.error(f"Error loading YAML file {file_path}: {str(e)}")
         raise
 
+@lru_cache(maxsize=8)
+def parse_yaml_file(file_path, mtime):
+    """
+    Parse a YAML file (cached)
+    
+    Args:
+        file_path (str): Path to the YAML file
+        mtime (float): Modification time of the file, part of the cache key
+        
+    Returns:
+        dict: Contents of the YAML file
+    """
+    with open(file_path, 'r') as file:
+        return yaml.load(file, Loader=YamlLoader)
+
 def load_config(config_dir):
     """
     Load all configuration files from the specified directory
@@ -60,8 +85,12 @@ def load_config(config_dir):
         config['warehouse']['connection_string'] = build_connection_string(config['warehouse'])
         
         # Create database engines
-        config['source']['engine'] = create_engine(config['source']['connection_string'])
-        config['warehouse']['engine'] = create_engine(config['warehouse']['connection_string'])
+        config['source']['engine'] = create_engine(
+            config['source']['connection_string'], **build_pool_options(config['source'])
+        )
+        config['warehouse']['engine'] = create_engine(
+            config['warehouse']['connection_string'], **build_pool_options(config['warehouse'])
+        )
         
         # Create metadata objects
         config['source']['metadata'] = MetaData()
@@ -72,6 +101,32 @@ def load_config(config_dir):
         logger.error(f"Error loading configuration: {str(e)}")
         raise
 
+def build_pool_options(db_config):
+    """
+    Build SQLAlchemy connection pool options from database configuration
+    
+    The pool must hold enough connections for the dimensions that are
+    transformed or loaded concurrently.
+    
+    Args:
+        db_config (dict): Database configuration
+        
+    Returns:
+        dict: Keyword arguments for create_engine
+    """
+    options = {
+        key: db_config[key]
+        for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+        if db_config.get(key) is not None
+    }
+    
+    # Never hand out fewer pooled connections than concurrent transform/load workers
+    workers = max(db_config.get('transform_workers') or 0, db_config.get('load_workers') or 0)
+    if workers and 'pool_size' in options:
+        options['pool_size'] = max(options['pool_size'], workers)
+    
+    return options
+
 def build_connection_string(db_config):
     """
     Build a SQLAlchemy connection string from database configuration
@@ -3,15 +3,24 @@ Data loading module for ETL process
 Loads transformed data into the data warehouse
 """
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from sqlalchemy import inspect
 from datetime import datetime
 import pandas as pd
-from sqlalchemy import Table, Column, Integer, String, DateTime, Float, Boolean, MetaData, ForeignKey, text, BigInteger
+from sqlalchemy import Table, Column, Integer, String, DateTime, Float, Boolean, MetaData, ForeignKey, text, BigInteger, bindparam
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 
 logger = logging.getLogger(__name__)
 
+# Serializes table creation, which goes through the shared SQLAlchemy metadata
+_SCHEMA_LOCK = threading.Lock()
+
+# Keys per IN (...) lookup of the records already in the warehouse
+KEY_LOOKUP_BATCH = 1000
+
 def load_data(transformed_data, config):
     """
     Load transformed data into the data warehouse
@@ -35,15 +44,29 @@ def load_data(transformed_data, config):
         warehouse_engine = config['warehouse']['engine']
         warehouse_metadata = config['warehouse']['metadata']
         
-        # Load dimension tables first
-        for dim_name, dim_df in transformed_data['dimensions'].items():
-            if not dim_df.empty:
-                load_result = load_dimension_table(dim_name, dim_df, warehouse_engine, warehouse_metadata, config)
-                results['tables_loaded'] += 1
-                results['rows_loaded'] += load_result['rows_loaded']
-                results['rows_updated'] += load_result['rows_updated']
-                results['rows_skipped'] += load_result['rows_skipped']
-                logger.info(f"Dimension {dim_name}: {load_result['rows_loaded']} loaded, {load_result['rows_updated']} updated, {load_result['rows_skipped']} skipped")
+        # Load dimension tables first. Dimensions do not reference each other, so they
+        # are loaded concurrently to overlap the warehouse round trips
+        dimensions = {
+            dim_name: dim_df for dim_name, dim_df in transformed_data['dimensions'].items() if not dim_df.empty
+        }
+        dim_results = {}
+        if dimensions:
+            max_workers = config['warehouse'].get('load_workers') or os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(dimensions))) as executor:
+                futures = {
+                    dim_name: executor.submit(
+                        load_dimension_table, dim_name, dim_df, warehouse_engine, warehouse_metadata, config
+                    )
+                    for dim_name, dim_df in dimensions.items()
+                }
+                dim_results = {dim_name: future.result() for dim_name, future in futures.items()}
+        
+        for dim_name, load_result in dim_results.items():
+            results['tables_loaded'] += 1
+            results['rows_loaded'] += load_result['rows_loaded']
+            results['rows_updated'] += load_result['rows_updated']
+            results['rows_skipped'] += load_result['rows_skipped']
+            logger.info(f"Dimension {dim_name}: {load_result['rows_loaded']} loaded, {load_result['rows_updated']} updated, {load_result['rows_skipped']} skipped")
         
         
         # Then load fact tables
@@ -90,35 +113,66 @@ def load_dimension_table(table_name, df, engine, metadata, config):
     df = df.replace({np.nan: None})
     
     try:
-        # Define the table if it doesn't exist
-        table_exists = inspect(engine).has_table(table_name)
-        #logger.info(f"Checking if table {table_name} exists: {table_exists}")
-        if not table_exists:
-            create_dimension_table(table_name, engine, metadata, config)
-            with engine.connect() as conn:
-                conn.commit()
-            metadata.clear()
-            import time
-            time.sleep(1)
+        # Define the table if it doesn't exist (one table at a time: dimensions load concurrently)
+        with _SCHEMA_LOCK:
+            table_exists = inspect(engine).has_table(table_name)
+            #logger.info(f"Checking if table {table_name} exists: {table_exists}")
+            if not table_exists:
+                create_dimension_table(table_name, engine, metadata, config)
+                with engine.connect() as conn:
+                    conn.commit()
+                metadata.clear()
+                import time
+                time.sleep(1)
 
         #Get business keys for this dimension
         business_keys = get_dimension_business_keys(table_name, config)
         #print(f"Business keys for {table_name}: {business_keys}")
         pk_column = get_table_primary_key(table_name)
+        key_columns = [normalize_column_name(key) for key in business_keys]
+        has_keys = bool(key_columns) and all(key in df.columns for key in key_columns)
+        batch_size = config['warehouse'].get('batch_size') or len(df) or 1
 
 
         with engine.connect() as conn:
             # Start transaction
             with conn.begin():
-                for _, row in df.iterrows():
-                    # Check if record exists using business keys
-                    existing_record = check_dimension_exists(conn, table_name, row, business_keys)
+                # Current records for the incoming business keys, read in a few queries
+                existing_records = {}
+                if has_keys:
+                    for record in fetch_existing_records(conn, table_name, df[key_columns], business_keys, current_only=True):
+                        record = dict(record._mapping)
+                        record_keys = {name.lower(): value for name, value in record.items()}
+                        existing_records[tuple(record_keys.get(key.lower()) for key in business_keys)] = record
+                    
+                    row_keys = list(df[key_columns].itertuples(index=False, name=None))
+                    has_null_key = df[key_columns].isna().any(axis=1).to_numpy()
+                    is_new = ~has_null_key & ~df[key_columns].duplicated().to_numpy()
+                    is_new &= np.array([key not in existing_records for key in row_keys], dtype=bool)
+                else:
+                    # Without business keys every row is a new record
+                    row_keys = [None] * len(df)
+                    is_new = np.ones(len(df), dtype=bool)
+                
+                # New business keys are inserted in batches
+                result['rows_loaded'] += insert_dimension_records(conn, table_name, df[is_new], batch_size, pk_column)
+                logger.debug(f"Inserted {result['rows_loaded']} new records in {table_name}")
+                
+                # Known keys go through the SCD Type 2 comparison one row at a time
+                for position in np.flatnonzero(~is_new):
+                    row = df.iloc[position]
+                    key = row_keys[position]
+                    # A record already compared (or a key repeated in this load) is read again,
+                    # as the earlier row may have replaced it
+                    existing_record = existing_records.pop(key, None) if key is not None else None
+                    if existing_record is None:
+                        existing_record = check_dimension_exists(conn, table_name, row, business_keys)
                     #logger.info(f"Checking existing record in {table_name} for business keys: {[row[key] for key in business_keys if key in row]}")
                     if existing_record:
                         if has_dimension_changed(conn, table_name, row, existing_record, business_keys):
                             expire_current_record(conn, table_name, existing_record[pk_column])
                             insert_new_dimension_record (conn, table_name, row, exclude_pk = True)
-                            result['rows_update'] += 1
+                            result['rows_updated'] += 1
                             logger.debug(f"Updated record in {table_name} with business keys: {[row[key] for key in business_keys if key in row]}")
                         else:
                             result['rows_skipped'] += 1
@@ -180,23 +234,19 @@ def load_fact_table(table_name, df, engine, metadata, config):
         unique_columns = get_fact_table_unique_columns(table_name, config)
         pk_column = get_table_primary_key(table_name)
         
+        batch_size = config['warehouse'].get('batch_size') or len(df) or 1
+        
         with engine.connect() as conn:
             # Start transaction
             with conn.begin():
-                for _, row in df.iterrows():
-                    # Check if record exists using unique columns
-                    existing_record = check_fact_exists(conn, table_name, row, unique_columns)
-                    
-                    if existing_record:
-                        # For facts, you might want to update or skip
-                        # Here we'll skip duplicates (most common approach)
-                        result['rows_skipped'] += 1
-                        logger.debug(f"Skipped duplicate record in {table_name}")
-                    else:
-                        # Insert new record
-                        insert_new_fact_record(conn, table_name, row, exclude_pk=True)
-                        result['rows_loaded'] += 1
-                        logger.debug(f"Inserted new record in {table_name}")
+                # Skip duplicates (most common approach for facts): records already in the
+                # table and repeated keys within this load, checked once for all rows
+                new_rows = drop_existing_fact_records(conn, table_name, df, unique_columns)
+                result['rows_skipped'] = len(df) - len(new_rows)
+                
+                # Insert the new records in batches
+                result['rows_loaded'] = insert_fact_records(conn, table_name, new_rows, batch_size, pk_column)
+                logger.debug(f"Inserted {result['rows_loaded']} records in {table_name}, skipped {result['rows_skipped']} duplicates")
         
         return result
     
@@ -291,6 +341,145 @@ def check_fact_exists(conn, table_name, row, unique_columns):
         logger.warning(f"Error checking fact existence: {str(e)}")
         return None
 
+def fetch_existing_records(conn, table_name, keys, key_columns, columns='*', current_only=False):
+    """
+    Read the records of a table that match a set of incoming keys
+    
+    Records are looked up with IN (...) on the first key column,
+    KEY_LOOKUP_BATCH values per query, so the lookup grows with the data
+    being loaded rather than with the table.
+    
+    Args:
+        conn: Database connection
+        table_name (str): Name of the table
+        keys (DataFrame): Incoming key values, one column per key column
+        key_columns (list): Key column names in the table
+        columns (str): Columns to select
+        current_only (bool): Only read records with Flag_Registro_Actual = TRUE
+        
+    Returns:
+        list: Matching rows
+    """
+    values = pd.unique(keys.iloc[:, 0].dropna()).tolist()
+    if not values:
+        return []
+    
+    query = f"SELECT {columns} FROM {table_name} WHERE {key_columns[0]} IN :keys"
+    if current_only:
+        query += " AND Flag_Registro_Actual = TRUE"
+    query = text(query).bindparams(bindparam('keys', expanding=True))
+    
+    rows = []
+    for start in range(0, len(values), KEY_LOOKUP_BATCH):
+        rows.extend(conn.execute(query, {'keys': values[start:start + KEY_LOOKUP_BATCH]}).fetchall())
+    return rows
+
+def drop_existing_fact_records(conn, table_name, df, unique_columns):
+    """
+    Remove the fact records whose unique columns are already in the table
+    
+    Only the table keys matching the incoming records are read, in a few
+    queries instead of one per row. A row is removed when all of its unique
+    columns equal an existing record, or a row earlier in the DataFrame.
+    Rows with a NULL in any unique column are always kept. Unlike
+    check_fact_exists, a partly NULL key is not matched on its non-NULL
+    columns. That only matters for composite keys, and every configured
+    fact table uses a single unique column.
+    
+    Args:
+        conn: Database connection
+        table_name (str): Name of the table
+        df (DataFrame): Normalized fact data
+        unique_columns (list): List of unique columns
+        
+    Returns:
+        DataFrame: Records to insert
+    """
+    key_columns = [normalize_column_name(key) for key in unique_columns]
+    if not key_columns or not all(key in df.columns for key in key_columns):
+        return df
+    
+    keys = df[key_columns]
+    rows = fetch_existing_records(conn, table_name, keys, unique_columns, columns=', '.join(unique_columns))
+    existing = pd.DataFrame([tuple(row) for row in rows], columns=key_columns)
+    
+    has_null_key = keys.isna().any(axis=1)
+    keys_index = pd.MultiIndex.from_frame(keys.astype(object))
+    existing_index = pd.MultiIndex.from_frame(existing.astype(object))
+    
+    is_duplicate = keys_index.isin(existing_index) | keys_index.duplicated()
+    return df[has_null_key.to_numpy() | ~is_duplicate]
+
+def insert_fact_records(conn, table_name, df, batch_size, pk_column=None):
+    """
+    Insert fact records with one executemany per batch
+    
+    Args:
+        conn: Database connection
+        table_name (str): Name of the table
+        df (DataFrame): Normalized fact records to insert
+        batch_size (int): Records per INSERT batch
+        pk_column (str): Primary key column to leave to the database
+        
+    Returns:
+        int: Number of inserted records
+    """
+    if df.empty:
+        return 0
+    
+    if pk_column:
+        df = df.drop(columns=[pk_column, normalize_column_name(pk_column)], errors='ignore')
+    
+    # Add audit fields for facts
+    current_time = datetime.now()
+    audit_fields = {
+        'Fecha_Creacion': current_time,
+        'Fecha_Ultima_Modificacion': current_time
+    }
+    df = df.drop(columns=list(audit_fields), errors='ignore')
+    
+    columns = list(df.columns) + list(audit_fields)
+    columns_str = ", ".join(columns)
+    placeholders_str = ", ".join([f":{col}" for col in columns])
+    insert_query = text(f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders_str})")
+    
+    for start in range(0, len(df), batch_size):
+        records = df.iloc[start:start + batch_size].to_dict('records')
+        for record in records:
+            record.update(audit_fields)
+        conn.execute(insert_query, records)
+    
+    return len(df)
+
+def insert_dimension_records(conn, table_name, df, batch_size, pk_column=None):
+    """
+    Insert new dimension records with one executemany per batch
+    
+    Args:
+        conn: Database connection
+        table_name (str): Name of the table
+        df (DataFrame): Normalized dimension records to insert
+        batch_size (int): Records per INSERT batch
+        pk_column (str): Primary key column to leave to the database
+        
+    Returns:
+        int: Number of inserted records
+    """
+    if df.empty:
+        return 0
+    
+    if pk_column:
+        df = df.drop(columns=[pk_column, normalize_column_name(pk_column)], errors='ignore')
+    
+    columns_str = ", ".join(df.columns)
+    placeholders_str = ", ".join([f":{col}" for col in df.columns])
+    insert_query = text(f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders_str})")
+    
+    for start in range(0, len(df), batch_size):
+        conn.execute(insert_query, df.iloc[start:start + batch_size].to_dict('records'))
+    
+    return len(df)
+
 def has_dimension_changed(conn, table_name, new_row, existing_record, business_keys):
     """
     Check if dimension data has changed (for SCD Type 2)
@@ -3,13 +3,46 @@ Data transformation module for ETL process
 Transforms extracted data into the format required by the data warehouse
 """
 import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from sqlalchemy import text
+from pandas.errors import UndefinedVariableError
+
+try:
+    import connectorx as cx
+except ImportError:
+    cx = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
 
 logger = logging.getLogger(__name__)
 
+# Dimension and fact tables from the data warehouse design, in load order
+DIMENSION_TABLES = (
+    'dimarea', 'dimtipocliente', 'dimciudad',
+    'dimcliente', 'dimsede', 'dimmensajero', 
+    'dimtiempo', 'dimusuario', 'dimdireccion', 
+    'dimtipopago', 'dimtipovehiculo', 'dimtiponovedad'
+)
+
+FACT_TABLES = (
+    'fact_servicios', 'fact_novedades',
+    'fact_estados_servicio'
+)
+
+# Values per multi-row INSERT when uploading staging tables
+STAGING_CHUNK_CELLS = 50000
+
 def transform_data(extracted_data, config):
     """
     Transform extracted data for loading into the data warehouse
@@ -27,6 +60,9 @@ def transform_data(extracted_data, config):
         'facts': {}
     }
     
+    # Single timestamp shared by the SCD columns of every table in this run
+    config['run_timestamp'] = pd.Timestamp.now()
+    
     try:
         # Transform dimension tables
         transform_dimensions(extracted_data, transformed_data, config)
@@ -37,13 +73,16 @@ def transform_data(extracted_data, config):
         return transformed_data
     
     except Exception as e:
-        logger.error(f"Error during data transformation: {str(e)}", exc_info=True)
+        logger.error("Error during data transformation: %s", e, exc_info=True)
         raise
 
 def transform_dimensions(extracted_data, transformed_data, config):
     """
     Transform dimension tables
     
+    Dimensions only read from the extracted data, never from each other, so
+    they are all transformed concurrently on a thread pool.
+    
     Args:
         extracted_data (dict): Dictionary of extracted dataframes
         transformed_data (dict): Dictionary to store transformed dataframes
@@ -52,29 +91,240 @@ def transform_dimensions(extracted_data, transformed_data, config):
     # Process dimension transformations based on configuration
     dim_transforms = config['sql_scripts'].get('transform_dimensions', {})
     
-    # List of dimension tables from the data warehouse design
-    dimension_tables = [
-        'dimarea', 'dimtipocliente', 'dimciudad',
-        'dimcliente', 'dimsede', 'dimmensajero', 
-        'dimtiempo', 'dimusuario', 'dimdireccion', 
-        'dimtipopago', 'dimtipovehiculo', 'dimtiponovedad'
-    ]
-    
-    for dim_table in dimension_tables:
+    tasks = {}
+    for dim_table in DIMENSION_TABLES:
         if dim_table in dim_transforms:
-            logger.info(f"Transforming {dim_table}")
-            transform_function = globals().get(f"transform_{dim_table.lower()}")
-            
-            if transform_function:
-                # Use specific transformation function if available
-                transformed_data['dimensions'][dim_table] = transform_function(extracted_data, config)
-            else:
-                # Use generic transformation based on SQL
-                transformed_data['dimensions'][dim_table] = transform_generic_dimension(
-                    extracted_data, dim_table, dim_transforms[dim_table], config
-                )
+            tasks[dim_table] = dim_transforms[dim_table]
         else:
-            logger.warning(f"No transformation defined for {dim_table}")
+            logger.warning("No transformation defined for %s", dim_table)
+    
+    if not tasks:
+        return
+    
+    max_workers = config['source'].get('transform_workers') or os.cpu_count() or 1
+    results = {}
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        futures = {
+            executor.submit(transform_single_dimension, extracted_data, dim_table, transform_config, config): dim_table
+            for dim_table, transform_config in tasks.items()
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    
+    # Keep the declared order so dimensions are loaded deterministically
+    for dim_table in tasks:
+        transformed_data['dimensions'][dim_table] = results[dim_table]
+
+def transform_single_dimension(extracted_data, dim_table, transform_config, config):
+    """
+    Transform one dimension table
+    
+    Args:
+        extracted_data (dict): Dictionary of extracted dataframes
+        dim_table (str): Name of the dimension table
+        transform_config (dict): Transformation configuration
+        config (dict): ETL configuration
+        
+    Returns:
+        DataFrame: Transformed dimension data
+    """
+    logger.info("Transforming %s", dim_table)
+    transform_function = _DIM_HANDLERS.get(dim_table)
+    
+    if transform_function:
+        # Use specific transformation function if available
+        return transform_function(extracted_data, config)
+    
+    # Use generic transformation based on SQL
+    return transform_generic_dimension(extracted_data, dim_table, transform_config, config)
+
+def use_duckdb(config, transform_config=None):
+    """
+    Check whether transformation SQL should run in an in-process DuckDB session
+    
+    Transformations run in the source database by default. A table opts in
+    with 'engine: duckdb' in its transformation configuration (or every
+    table, with 'transform_engine: duckdb' in the source configuration)
+    once its SQL runs in DuckDB and the result dtypes have been checked.
+    
+    Args:
+        config (dict): ETL configuration
+        transform_config (dict): Transformation configuration of the table
+        
+    Returns:
+        bool: True when DuckDB is installed and selected as transform engine
+    """
+    engine = (transform_config or {}).get('engine') or config['source'].get('transform_engine', 'source')
+    return duckdb is not None and engine == 'duckdb'
+
+def run_duckdb_sql(sql, frames, table_name):
+    """
+    Run a transformation query in DuckDB directly over in-memory dataframes
+    
+    The dataframes are registered as views, so nothing is copied into or
+    read back from the source database.
+    
+    Args:
+        sql (str): Transformation SQL
+        frames (dict): Dataframes to expose to the query, keyed by table name
+        table_name (str): Name of the table being transformed
+        
+    Returns:
+        DataFrame or None: Query result, or None if DuckDB could not run the query
+    """
+    con = duckdb.connect()
+    try:
+        for name, df in frames.items():
+            con.register(name, df)
+        
+        result = con.execute(sql).df()
+        logger.info("Transformed %s with DuckDB: %d rows", table_name, len(result))
+        return result
+    except duckdb.Error as e:
+        logger.warning("DuckDB could not run the %s SQL, falling back to the source engine: %s", table_name, e)
+        # Check the registered inputs on the same connection
+        for name in frames:
+            try:
+                count = con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                logger.debug("%s has %d rows", name, count)
+            except duckdb.Error as check_e:
+                logger.error("Error checking %s: %s", name, check_e)
+        return None
+    finally:
+        con.close()
+
+def project_columns(df, sql):
+    """
+    Keep only the columns of a dataframe that a query can reference
+    
+    A column is kept when its name appears as a word in the SQL. Queries with
+    a '*' other than COUNT(*) (SELECT *, t.*, multiplication) may need every
+    column, so the dataframe is returned unchanged for them.
+    
+    Args:
+        df (DataFrame): Source dataframe
+        sql (str): SQL query
+        
+    Returns:
+        DataFrame: Dataframe with the referenced columns
+    """
+    if not sql or '*' in re.sub(r"count\s*\(\s*\*\s*\)", "", sql, flags=re.IGNORECASE):
+        return df
+    
+    words = set(re.findall(r"\w+", sql.lower()))
+    columns = [column for column in df.columns if str(column).lower() in words]
+    if not columns or len(columns) == len(df.columns):
+        return df
+    
+    return df[columns]
+
+def sql_references(sql, table_name):
+    """
+    Check whether a query references a table by its full name
+    
+    Args:
+        sql (str): SQL query
+        table_name (str): Table name to look for
+        
+    Returns:
+        bool: True if the table name appears as a whole word in the query
+    """
+    return re.search(rf"\b{re.escape(table_name)}\b", sql) is not None
+
+def stage_temp_table(df, temp_table_name, conn):
+    """
+    Upload a dataframe as a staging table, replacing any previous version
+    
+    Rows are sent as multi-row INSERT statements sized by the column count,
+    so wide frames need far fewer statements than one INSERT per row.
+    
+    Args:
+        df (DataFrame): Data to stage
+        temp_table_name (str): Name of the staging table
+        conn: Database connection
+    """
+    df.to_sql(
+        temp_table_name, 
+        conn, 
+        if_exists='replace', 
+        index=False,
+        method='multi',
+        chunksize=max(STAGING_CHUNK_CELLS // max(len(df.columns), 1), 1)
+    )
+
+def read_sql_result(sql, conn, config):
+    """
+    Run a transformation query and return its result as a dataframe
+    
+    When connectorx is installed the rows are fetched straight into Arrow
+    buffers and converted without building Python tuples. Otherwise, or if
+    connectorx (or pyarrow) fails, pd.read_sql is used on conn. Both paths
+    return the same dtypes.
+    
+    Args:
+        sql (str): Transformation SQL
+        conn: Database connection holding the staging tables
+        config (dict): ETL configuration
+        
+    Returns:
+        DataFrame: Query result
+    """
+    if cx is not None:
+        # connectorx opens its own connection, so the staging tables must be committed
+        conn.commit()
+        try:
+            table = cx.read_sql(
+                config['source']['connection_string'],
+                sql.strip().rstrip(';'),
+                return_type='arrow'
+            )
+            return normalize_arrow_dtypes(table.to_pandas(split_blocks=True, self_destruct=True))
+        except (ImportError, RuntimeError) as e:
+            logger.warning("connectorx could not run the query, falling back to pd.read_sql: %s", e)
+    
+    return pd.read_sql(sql, conn)
+
+def normalize_arrow_dtypes(df):
+    """
+    Give a dataframe converted from Arrow the dtypes pd.read_sql returns
+    
+    Arrow keeps the source precision of timestamps (e.g. microseconds for
+    PostgreSQL), while pd.read_sql always returns nanosecond timestamps.
+    
+    Args:
+        df (DataFrame): Query result converted from Arrow
+        
+    Returns:
+        DataFrame: Query result with nanosecond timestamps
+    """
+    casts = {}
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.DatetimeTZDtype) and dtype.unit != 'ns':
+            casts[column] = pd.DatetimeTZDtype('ns', dtype.tz)
+        elif dtype.kind == 'M' and dtype != np.dtype('datetime64[ns]'):
+            casts[column] = 'datetime64[ns]'
+    
+    return df.astype(casts) if casts else df
+
+def qualify_temp_tables(sql, table_name, source_tables):
+    """
+    Point temp_<source> references in a transformation query to the staging
+    tables owned by table_name, so concurrent transforms never share them
+    
+    Args:
+        sql (str): Transformation SQL
+        table_name (str): Name of the table being transformed
+        source_tables (list): Source tables referenced by the SQL
+        
+    Returns:
+        str: SQL using the table-specific staging names
+    """
+    if not source_tables:
+        return sql
+    
+    pattern = re.compile(r"\btemp_(" + "|".join(map(re.escape, source_tables)) + r")\b")
+    return pattern.sub(lambda match: f"temp_{table_name}_{match.group(1)}", sql)
 
 def transform_facts(extracted_data, transformed_data, config):
     """
@@ -88,33 +338,21 @@ def transform_facts(extracted_data, transformed_data, config):
     # Process fact transformations based on configuration
     fact_transforms = config['sql_scripts'].get('transform_facts', {})
     
-    # List of fact tables from the data warehouse design
-    fact_tables = [
-        'fact_servicios', 'fact_novedades',
-        'fact_estados_servicio'
-    ]
-    
-    for fact_table in fact_tables:
+    for fact_table in FACT_TABLES:
         if fact_table in fact_transforms:
-            logger.info(f"Transforming {fact_table}")
-            transform_function = globals().get(f"transform_{fact_table.lower()}")
+            logger.info("Transforming %s", fact_table)
+            transform_function = _FACT_HANDLERS.get(fact_table)
             
             if transform_function:
                 # Use specific transformation function if available
                 transformed_data['facts'][fact_table] = transform_function(extracted_data, transformed_data, config)
             else:
-                if fact_table == 'fact_servicios':
-                    logger.info("Using specific transformation for fact_servicios")
-                    transformed_data['facts'][fact_table] = transform_fact_servicios(
-                        extracted_data, transformed_data, config
-                    )
-                else:
-                    # Use generic transformation based on SQL
-                    transformed_data['facts'][fact_table] = transform_generic_fact(
-                        extracted_data, transformed_data, fact_table, fact_transforms[fact_table], config
-                    )
+                # Use generic transformation based on SQL
+                transformed_data['facts'][fact_table] = transform_generic_fact(
+                    extracted_data, transformed_data, fact_table, fact_transforms[fact_table], config
+                )
         else:
-            logger.warning(f"No transformation defined for {fact_table}")
+            logger.warning("No transformation defined for %s", fact_table)
 
 def transform_generic_dimension(extracted_data, table_name, transform_config, config):
     """
@@ -135,60 +373,69 @@ def transform_generic_dimension(extracted_data, table_name, transform_config, co
     # Check if we have all required source data
     for source_table in source_tables:
         if source_table not in extracted_data:
-            logger.error(f"Missing required source data: {source_table}")
+            logger.error("Missing required source data: %s", source_table)
             raise ValueError(f"Missing required source data: {source_table}")
     
+    # Nothing to transform when every source is empty (e.g. an incremental run without new rows)
+    if source_tables and all(extracted_data[source_table].empty for source_table in source_tables):
+        logger.info("No source rows for %s, skipping transformation", table_name)
+        return get_empty_result(transform_config)
+    
     # Apply transformation SQL if specified
     if 'sql' in transform_config:
-        # Create temporary tables for each source dataframe
-        with config['source']['engine'].connect() as conn:
-            # Log the available tables for debugging
-            logger.info(f"Available source tables: {list(extracted_data.keys())}")
-            
-            # Create temporary tables with consistent naming
-            for source_table in source_tables:
-                temp_table_name = f"temp_{source_table}"
-                logger.info(f"Creating temporary table: {temp_table_name}")
+        # Only the columns the SQL can reference are handed to the query engine
+        sources = {
+            source_table: project_columns(extracted_data[source_table], transform_config['sql'])
+            for source_table in source_tables
+        }
+        
+        result = None
+        if use_duckdb(config, transform_config):
+            result = run_duckdb_sql(
+                qualify_temp_tables(transform_config['sql'], table_name, source_tables),
+                {f"temp_{table_name}_{source_table}": sources[source_table] for source_table in source_tables},
+                table_name
+            )
+        
+        if result is None:
+            # Create temporary tables for each source dataframe
+            with config['source']['engine'].connect() as conn:
+                # Create temporary tables with consistent naming
+                for source_table in source_tables:
+                    temp_table_name = f"temp_{table_name}_{source_table}"
+                    nrows = len(sources[source_table])
+                    logger.debug("Creating temporary table: %s", temp_table_name)
+                    
+                    # Create the temporary table - replaced if already exists
+                    try:
+                        stage_temp_table(sources[source_table], temp_table_name, conn)
+                        logger.debug("Created temp table %s with %d rows", temp_table_name, nrows)
+                    except Exception as e:
+                        logger.error("Error creating temp table %s with %d rows: %s", temp_table_name, nrows, e)
+                        logger.error("Available source tables: %s", extracted_data.keys())
+                        raise
+                
+                # Now replace the table names in the SQL query to match our temp table names
+                modified_sql = qualify_temp_tables(transform_config['sql'], table_name, source_tables)
                 
-                # Create the temporary table - drop if already exists
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Executing SQL: %s", modified_sql)
+                
+                # Execute transformation SQL
                 try:
-                    #conn.execute(f"DROP TABLE IF EXISTS {temp_table_name}")
-                    extracted_data[source_table].to_sql(
-                        temp_table_name, 
-                        conn, 
-                        if_exists='replace', 
-                        index=False
-                    )
-                    logger.info(f"Created temp table {temp_table_name} with {len(extracted_data[source_table])} rows")
+                    result = read_sql_result(modified_sql, conn, config)
+                    logger.info("Transformed %s: %d rows", table_name, len(result))
                 except Exception as e:
-                    logger.error(f"Error creating temp table {temp_table_name}: {str(e)}")
+                    logger.error("Error executing SQL: %s", e)
+                    logger.error("Failed SQL for %s: %s", table_name, modified_sql)
+                    # Check if temp tables exist
+                    for source_table in source_tables:
+                        try:
+                            count = pd.read_sql(f"SELECT COUNT(*) FROM temp_{table_name}_{source_table}", conn)
+                            logger.info("temp_%s_%s has %d rows", table_name, source_table, count.iloc[0, 0])
+                        except Exception as check_e:
+                            logger.error("Error checking temp_%s_%s: %s", table_name, source_table, check_e)
                     raise
-            
-            # Now replace the table names in the SQL query to match our temp table names
-            modified_sql = transform_config['sql']
-            for source_table in source_tables:
-                # Replace references to the table name in SQL with the temp table name
-                table_pattern = f"temp_{source_table}"
-                # Make sure we're only replacing full table names, not parts of other words
-                modified_sql = modified_sql.replace(f"FROM {table_pattern}", f"FROM temp_{source_table}")
-                modified_sql = modified_sql.replace(f"JOIN {table_pattern}", f"JOIN temp_{source_table}")
-            
-            logger.info(f"Executing SQL: {modified_sql}")
-            
-            # Execute transformation SQL
-            try:
-                result = pd.read_sql(modified_sql, conn)
-                logger.info(f"SQL execution returned {len(result)} rows")
-            except Exception as e:
-                logger.error(f"Error executing SQL: {str(e)}")
-                # Check if temp tables exist
-                for source_table in source_tables:
-                    try:
-                        count = pd.read_sql(f"SELECT COUNT(*) FROM temp_{source_table}", conn)
-                        logger.info(f"temp_{source_table} has {count.iloc[0, 0]} rows")
-                    except Exception as check_e:
-                        logger.error(f"Error checking temp_{source_table}: {str(check_e)}")
-                raise
     else:
         # Otherwise just use mapping configuration to transform
         source_df = extracted_data[source_tables[0]]
@@ -205,19 +452,20 @@ def transform_generic_dimension(extracted_data, table_name, transform_config, co
                 # Complex transformation
                 if 'expression' in source_info:
                     # Apply Python expression
-                    result[target_col] = eval(source_info['expression'], 
-                                             {'df': source_df, 'np': np, 'pd': pd})
+                    result[target_col] = evaluate_expression(source_info['expression'], source_df)
     
     # Add SCD Type 2 fields if not present
+    current_datetime = get_run_timestamp(config).to_datetime64()
+    n_rows = len(result)
     if not 'fecha_inicio_validez' in result.columns:
-        result['fecha_inicio_validez'] = datetime.now()
+        result['fecha_inicio_validez'] = np.full(n_rows, current_datetime, dtype='datetime64[ns]')
     if not 'fecha_fin_validez' in result.columns:
-        result['fecha_fin_validez'] = pd.Timestamp.max
+        result['fecha_fin_validez'] = np.full(n_rows, pd.Timestamp.max.to_datetime64(), dtype='datetime64[ns]')
     if not 'flag_registro_actual' in result.columns:
-        result['flag_registro_actual'] = True
+        result['flag_registro_actual'] = np.ones(n_rows, dtype=np.bool_)
     if not 'fecha_ultima_modificacion' in result.columns:
-        result['fecha_ultima_modificacion'] = datetime.now()
-        
+        result['fecha_ultima_modificacion'] = np.full(n_rows, current_datetime, dtype='datetime64[ns]')
+    
     return result
 
 def transform_generic_fact(extracted_data, transformed_data, table_name, transform_config, config):
@@ -240,78 +488,148 @@ def transform_generic_fact(extracted_data, transformed_data, table_name, transfo
     # Check if we have all required source data
     for source_table in source_tables:
         if source_table not in extracted_data:
-            logger.error(f"Missing required source data: {source_table}")
+            logger.error("Missing required source data: %s", source_table)
             raise ValueError(f"Missing required source data: {source_table}")
     
-    # Create temporary tables for each source and transformed dataframe
-    with config['source']['engine'].connect() as conn:
-        # Log available tables
-        logger.info(f"Available source tables for fact transformation: {list(extracted_data.keys())}")
-        logger.info(f"Available dimension tables: {list(transformed_data['dimensions'].keys())}")
-        
-        # Create temp tables for extracted data
-        for source_table in source_tables:
-            temp_table_name = f"temp_{source_table}"
-            logger.info(f"Creating temporary table for fact: {temp_table_name}")
-            
-            try:
-                conn.execute(text(f"DROP TABLE IF EXISTS {temp_table_name}"))
-                extracted_data[source_table].to_sql(
-                    temp_table_name, 
-                    conn, 
-                    if_exists='replace', 
-                    index=False
-                )
-                logger.info(f"Created temp table {temp_table_name} with {len(extracted_data[source_table])} rows")
-            except Exception as e:
-                logger.error(f"Error creating temp table {temp_table_name}: {str(e)}")
-                raise
-        
-        # Create temp tables for transformed dimensions
-        for dim_name, dim_df in transformed_data['dimensions'].items():
-            temp_dim_name = f"temp_{dim_name}"
-            logger.info(f"Creating temporary table for dimension: {temp_dim_name}")
-            
-            try:
-                conn.execute(text(f"DROP TABLE IF EXISTS {temp_dim_name}"))
-                dim_df.to_sql(
-                    temp_dim_name, 
-                    conn, 
-                    if_exists='replace', 
-                    index=False
-                )
-                logger.info(f"Created temp dimension table {temp_dim_name} with {len(dim_df)} rows")
-            except Exception as e:
-                logger.error(f"Error creating temp dimension table {temp_dim_name}: {str(e)}")
-                raise
-        
-        # Execute transformation SQL
-        if 'sql' in transform_config:
-            # Replace table references to match our temp tables
-            modified_sql = transform_config['sql']
-            
-            # Modify SQL to use our temp table names
+    # Nothing to transform when every source is empty (e.g. an incremental run without new rows)
+    if source_tables and all(extracted_data[source_table].empty for source_table in source_tables):
+        logger.info("No source rows for %s, skipping transformation", table_name)
+        return get_empty_result(transform_config)
+    
+    # Only the columns the SQL can reference are handed to the query engine
+    fact_sql = transform_config.get('sql', '')
+    sources = {
+        source_table: project_columns(extracted_data[source_table], fact_sql)
+        for source_table in source_tables
+    }
+    
+    result = None
+    if 'sql' in transform_config and use_duckdb(config, transform_config):
+        frames = {f"temp_{table_name}_{source_table}": sources[source_table] for source_table in source_tables}
+        frames.update({
+            f"temp_{dim_name}": project_columns(dim_df, fact_sql)
+            for dim_name, dim_df in transformed_data['dimensions'].items()
+            if sql_references(fact_sql, f"temp_{dim_name}")
+        })
+        result = run_duckdb_sql(
+            qualify_temp_tables(transform_config['sql'], table_name, source_tables),
+            frames,
+            table_name
+        )
+    
+    if result is None:
+        # Create temporary tables for each source and transformed dataframe
+        with config['source']['engine'].connect() as conn:
+            # Create temp tables for extracted data
             for source_table in source_tables:
-                # Replace references to the table name in SQL with the temp table name
-                table_pattern = f"temp_{source_table}"
-                modified_sql = modified_sql.replace(f"FROM {table_pattern}", f"FROM temp_{source_table}")
-                modified_sql = modified_sql.replace(f"JOIN {table_pattern}", f"JOIN temp_{source_table}")
+                temp_table_name = f"temp_{table_name}_{source_table}"
+                nrows = len(sources[source_table])
+                logger.debug("Creating temporary table for fact: %s", temp_table_name)
+                
+                try:
+                    stage_temp_table(sources[source_table], temp_table_name, conn)
+                    logger.debug("Created temp table %s with %d rows", temp_table_name, nrows)
+                except Exception as e:
+                    logger.error("Error creating temp table %s with %d rows: %s", temp_table_name, nrows, e)
+                    logger.error("Available source tables for fact transformation: %s", extracted_data.keys())
+                    raise
             
-            logger.info(f"Executing fact SQL: {modified_sql}")
+            # Create temp tables for the transformed dimensions referenced by the fact SQL
+            for dim_name, dim_df in transformed_data['dimensions'].items():
+                temp_dim_name = f"temp_{dim_name}"
+                if not sql_references(fact_sql, temp_dim_name):
+                    continue
+                
+                nrows = len(dim_df)
+                logger.debug("Creating temporary table for dimension: %s", temp_dim_name)
+                
+                try:
+                    stage_temp_table(project_columns(dim_df, fact_sql), temp_dim_name, conn)
+                    logger.debug("Created temp dimension table %s with %d rows", temp_dim_name, nrows)
+                except Exception as e:
+                    logger.error("Error creating temp dimension table %s with %d rows: %s", temp_dim_name, nrows, e)
+                    logger.error("Available dimension tables: %s", transformed_data['dimensions'].keys())
+                    raise
             
-            try:
-                result = pd.read_sql(modified_sql, conn)
-                logger.info(f"SQL execution returned {len(result)} rows for fact table")
-            except Exception as e:
-                logger.error(f"Error executing fact SQL: {str(e)}")
-                raise
-        else:
-            # Default transformation if no SQL provided
-            logger.warning(f"No SQL transformation defined for {table_name}, using default transformation")
-            result = transform_default_fact(extracted_data, transformed_data, table_name, transform_config)
-    
+            # Execute transformation SQL
+            if 'sql' in transform_config:
+                # Replace table references to match our temp tables
+                modified_sql = qualify_temp_tables(transform_config['sql'], table_name, source_tables)
+                
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Executing fact SQL: %s", modified_sql)
+                
+                try:
+                    result = read_sql_result(modified_sql, conn, config)
+                    logger.info("Transformed %s: %d rows", table_name, len(result))
+                except Exception as e:
+                    logger.error("Error executing fact SQL: %s", e)
+                    logger.error("Failed SQL for %s: %s", table_name, modified_sql)
+                    raise
+            else:
+                # Default transformation if no SQL provided
+                logger.warning("No SQL transformation defined for %s, using default transformation", table_name)
+                result = transform_default_fact(extracted_data, transformed_data, table_name, transform_config)
+        
     return result
 
+def get_run_timestamp(config):
+    """
+    Get the timestamp of the current ETL run
+    
+    Args:
+        config (dict): ETL configuration
+        
+    Returns:
+        Timestamp: Run timestamp set by transform_data, or now if unset
+    """
+    run_timestamp = config.get('run_timestamp')
+    return pd.Timestamp(run_timestamp) if run_timestamp is not None else pd.Timestamp.now()
+
+def get_empty_result(transform_config):
+    """
+    Build an empty result for a table whose source data is empty
+    
+    The schema comes from the table's 'output_columns': either a list of
+    column names (object columns) or a mapping of column name to dtype.
+    
+    Args:
+        transform_config (dict): Transformation configuration
+        
+    Returns:
+        DataFrame: Empty transformed data
+    """
+    output_columns = transform_config.get('output_columns', [])
+    if isinstance(output_columns, dict):
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in output_columns.items()})
+    
+    return pd.DataFrame(columns=output_columns)
+
+def evaluate_expression(expression, df):
+    """
+    Evaluate a mapping expression over a source dataframe
+    
+    Expressions written over bare column names (e.g. 'precio * cantidad') go
+    through DataFrame.eval, which uses numexpr when it is installed.
+    Expressions referencing df[...], and those DataFrame.eval cannot parse
+    or resolve (string methods, function calls), use Python eval with df,
+    np and pd in scope.
+    
+    Args:
+        expression (str): Expression from the mapping configuration
+        df (DataFrame): Source dataframe
+        
+    Returns:
+        Series or scalar: Evaluated expression
+    """
+    if 'df[' not in expression:
+        try:
+            return df.eval(expression)
+        except (UndefinedVariableError, SyntaxError, NotImplementedError, TypeError, ValueError):
+            pass
+    
+    return eval(expression, {'df': df, 'np': np, 'pd': pd})
+
 def transform_default_fact(extracted_data, transformed_data, table_name, transform_config):
     """
     Apply default transformation for fact tables when no specific SQL is provided
@@ -331,24 +649,23 @@ def transform_default_fact(extracted_data, transformed_data, table_name, transfo
     if not source_tables:
         return pd.DataFrame()
     
-    # Start with the first source table
-    result = extracted_data[source_tables[0]].copy()
+    # Start with the first source table (only read, so it is not copied)
+    result = extracted_data[source_tables[0]]
     
     # Apply mappings if provided
     mappings = transform_config.get('mappings', {})
     if mappings:
-        new_df = pd.DataFrame()
+        new_columns = {}
         for target_col, source_info in mappings.items():
             if isinstance(source_info, str):
                 # Simple column mapping
-                new_df[target_col] = result[source_info]
+                new_columns[target_col] = result[source_info]
             elif isinstance(source_info, dict):
                 # Complex transformation
                 if 'expression' in source_info:
                     # Apply Python expression
-                    new_df[target_col] = eval(source_info['expression'], 
-                                             {'df': result, 'np': np, 'pd': pd})
-        result = new_df
+                    new_columns[target_col] = evaluate_expression(source_info['expression'], result)
+        result = pd.DataFrame(new_columns, index=result.index)
     
     return result
 
@@ -365,7 +682,7 @@ def transform_dimtiempo(extracted_data, config, last_run_timestamp=None):
     else:
         start_date = pd.to_datetime(config.get('dimtiempo_start_date', '2020-01-01'))
     
-    end_date = pd.Timestamp.now().floor('H')  # Hasta la hora actual
+    end_date = get_run_timestamp(config).floor('H')  # Hasta la hora actual (inicio de la corrida)
     
     # Solo procesar si hay nuevas horas
     if start_date >= end_date:
@@ -375,39 +692,50 @@ def transform_dimtiempo(extracted_data, config, last_run_timestamp=None):
     # Generate date range (solo nuevos períodos)
     date_range = pd.date_range(start=start_date, end=end_date, freq='H')
     
+    # Calendar components from integer arithmetic on the hourly datetime64 values
+    horas = date_range.to_numpy().astype('datetime64[h]')
+    meses = horas.astype('datetime64[M]')
+    dias = horas.astype('datetime64[D]')
+    
+    anio = meses.astype(np.int64) // 12 + 1970
+    mes = meses.astype(np.int64) % 12 + 1
+    dia = (dias - meses).astype(np.int64) + 1
+    hora = horas.astype(np.int64) % 24
+    trimestre = (mes - 1) // 3 + 1
+    dia_semana = (dias.astype(np.int64) + 3) % 7  # 1970-01-01 fue jueves; lunes = 0
+    
     # Create dataframe con nombres en minúsculas
     df = pd.DataFrame({
         #'dk_tiempo': date_range.strftime('%Y%m%d%H').astype(int),
-        'id_fecha_completa': date_range.strftime('%Y%m%d%H').astype('int64'),
+        'id_fecha_completa': anio * 1_000_000 + mes * 10_000 + dia * 100 + hora,
         'fecha_completa': date_range,
-        'anio': date_range.year,
-        'semestre': ((date_range.quarter - 1) // 2 + 1),
-        'trimestre': date_range.quarter,
-        'mes': date_range.month,
-        'semana': date_range.isocalendar().week,
-        'dia': date_range.day,
-        'dia_semana': date_range.dayofweek,
-        'es_fin_semana': date_range.dayofweek >= 5,
+        'anio': anio,
+        'semestre': (trimestre - 1) // 2 + 1,
+        'trimestre': trimestre,
+        'mes': mes,
+        'semana': date_range.isocalendar().week.to_numpy(dtype=np.int64),
+        'dia': dia,
+        'dia_semana': dia_semana,
+        'es_fin_semana': dia_semana >= 5,
         'es_feriado': False,
-        'hora': date_range.hour,
+        'hora': hora,
         'minuto': 0,  # Como es por hora, minuto siempre 0
-        'periodo_dia': pd.cut(
-            date_range.hour,
-            bins=[0, 12, 18, 24],
-            labels=['Mañana', 'Tarde', 'Noche'],
-            include_lowest=True,
-            right=False
+        'periodo_dia': pd.Categorical.from_codes(
+            # 0-11 -> Mañana, 12-17 -> Tarde, 18-23 -> Noche (dos comparaciones, sin ramas)
+            (hora >= 12).astype(np.int8) + (hora >= 18).astype(np.int8),
+            categories=['Mañana', 'Tarde', 'Noche']
         ),
-        'anio_mes': date_range.strftime('%Y%m').astype(int)
+        'anio_mes': anio * 100 + mes
     })
     
     # Add SCD Type 2 fields
-    current_datetime = datetime.now()
-    df['fecha_creacion'] = current_datetime
-    df['fecha_inicio_validez'] = current_datetime
-    df['fecha_fin_validez'] = pd.Timestamp.max
-    df['flag_registro_actual'] = True
-    df['fecha_ultima_modificacion'] = current_datetime
+    current_datetime = get_run_timestamp(config).to_datetime64()
+    n_rows = len(df)
+    df['fecha_creacion'] = np.full(n_rows, current_datetime, dtype='datetime64[ns]')
+    df['fecha_inicio_validez'] = df['fecha_creacion']
+    df['fecha_fin_validez'] = np.full(n_rows, pd.Timestamp.max.to_datetime64(), dtype='datetime64[ns]')
+    df['flag_registro_actual'] = np.ones(n_rows, dtype=np.bool_)
+    df['fecha_ultima_modificacion'] = df['fecha_creacion']
     
     return df
 
@@ -429,177 +757,303 @@ def transform_fact_servicios(extracted_data, transformed_data, config):
     required_tables = ['servicio', 'estados_servicio', 'estado', 'tipo_servicio']
     for table in required_tables:
         if table not in extracted_data:
-            logger.error(f"Missing required source data: {table}")
+            logger.error("Missing required source data: %s", table)
             raise ValueError(f"Missing required source data: {table}")
     
-    # Get source dataframes
-    df_servicio = extracted_data['servicio'].copy()
-    df_estados_servicio = extracted_data['estados_servicio'].copy()
-    df_estado = extracted_data['estado'].copy()
-    df_tipo_servicio = extracted_data['tipo_servicio'].copy()
-    
-    logger.info(f"Processing {len(df_servicio)} services")
-    
-    # Merge estados_servicio with estado to get state names
-    df_estados_with_names = df_estados_servicio.merge(
-        df_estado[['estado_id', 'nombre']], 
+    # Get source dataframes, narrowed to the columns used below
+    # (read-only: new columns go through assign, not in-place writes)
+    df_servicio = extracted_data['servicio'][[
+        'servicio_id', 'cliente_id', 'usuario_id', 'mensajero_id', 'mensajero2_id', 'mensajero3_id',
+        'origen_id', 'destino_id', 'tipo_pago_id', 'tipo_vehiculo_id', 'tipo_servicio_id',
+        'fecha_solicitud', 'hora_solicitud', 'fecha_deseada', 'hora_deseada',
+        'descripcion', 'nombre_solicitante', 'nombre_recibe', 'telefono_recibe', 'descripcion_pago',
+        'ida_y_regreso', 'prioridad', 'multiples_origenes', 'activo', 'es_prueba'
+    ]]
+    df_estados_servicio = extracted_data['estados_servicio'][['servicio_id', 'estado_id', 'fecha', 'hora']]
+    df_estado = extracted_data['estado']
+    df_tipo_servicio = extracted_data['tipo_servicio']
+    
+    logger.info("Processing %d services", len(df_servicio))
+    
+    # Merge estados_servicio with estado to get state names (on int32 keys)
+    df_estados_with_names = df_estados_servicio.assign(
+        estado_id=downcast_key(df_estados_servicio['estado_id'])
+    ).merge(
+        df_estado[['estado_id', 'nombre']].assign(estado_id=downcast_key(df_estado['estado_id'])), 
         on='estado_id', 
-        how='left'
+        how='left',
+        sort=False
     )
     
-    # Use safe datetime conversion
-    df_estados_with_names['fecha_hora'] = safe_datetime_conversion(
-        df_estados_with_names['fecha'], 
-        df_estados_with_names['hora'], 
-        "estados_servicio_fecha_hora"
-    )
-    
-    df_servicio['fecha_hora_solicitud'] = safe_datetime_conversion(
-        df_servicio['fecha_solicitud'], 
-        df_servicio['hora_solicitud'], 
-        "servicio_fecha_hora_solicitud"
-    )
-    
-    df_servicio['fecha_hora_deseada'] = safe_datetime_conversion(
-        df_servicio['fecha_deseada'], 
-        df_servicio['hora_deseada'], 
-        "servicio_fecha_hora_deseada"
-    )
+    # Use safe datetime conversion; only the columns used downstream are kept
+    df_estados_with_names = df_estados_with_names.assign(
+        fecha_hora=safe_datetime_conversion(
+            df_estados_with_names['fecha'], 
+            df_estados_with_names['hora'], 
+            "estados_servicio_fecha_hora"
+        )
+    )[['servicio_id', 'fecha_hora', 'nombre']]
     
     # Calculate aggregated information per service
     logger.info("Calculating service states aggregations...")
     
-    # Get last update time per service
-    ultima_actualizacion = df_estados_with_names.groupby('servicio_id').agg({
-        'fecha_hora': 'max'
-    }).reset_index()
-    ultima_actualizacion.columns = ['servicio_id', 'ultima_actualizacion']
-    
-    # Get current state (most recent) per service
-    estado_actual = df_estados_with_names.loc[
-        df_estados_with_names.groupby('servicio_id')['fecha_hora'].idxmax()
-    ][['servicio_id', 'nombre']].rename(columns={'nombre': 'estado_actual'})
-    
     # Define state categories for calculations
     estados_asignacion = ['Con mensajero Asignado', 'Iniciado']
     estados_completado = ['Entregado en destino', 'Terminado completo']
     estados_cancelado = ['Con novedad']
     
-    # Get first assignment time per service
-    df_asignacion = df_estados_with_names[
-        df_estados_with_names['nombre'].isin(estados_asignacion)
-    ]
-    primera_asignacion = df_asignacion.groupby('servicio_id').agg({
-        'fecha_hora': 'min'
-    }).reset_index()
-    primera_asignacion.columns = ['servicio_id', 'primera_asignacion']
-    
-    # Get first completion time per service
-    df_completado = df_estados_with_names[
-        df_estados_with_names['nombre'].isin(estados_completado)
-    ]
-    primera_completado = df_completado.groupby('servicio_id').agg({
-        'fecha_hora': 'min'
-    }).reset_index()
-    primera_completado.columns = ['servicio_id', 'primera_completado']
-    
-    # Check for flags
-    servicios_completados = set(df_completado['servicio_id'].unique())
-    servicios_cancelados = set(df_estados_with_names[
-        df_estados_with_names['nombre'].isin(estados_cancelado)
-    ]['servicio_id'].unique())
-    
-    # Start building the result dataframe
-    result = df_servicio.copy()
-    
-    # Add aggregated information
-    result = result.merge(ultima_actualizacion, on='servicio_id', how='left')
-    result = result.merge(estado_actual, on='servicio_id', how='left')
-    result = result.merge(primera_asignacion, on='servicio_id', how='left')
-    result = result.merge(primera_completado, on='servicio_id', how='left')
-    
-    # Add tipo_servicio information
+    # Classify every state change once: 0=asignacion, 1=completado, 2=cancelado, 3=otro.
+    # The category codes index a lookup table; unknown names get code -1, i.e. the last entry
+    estados_dtype = pd.CategoricalDtype(estados_asignacion + estados_completado + estados_cancelado)
+    bucket_por_codigo = np.array(
+        [0] * len(estados_asignacion) + [1] * len(estados_completado) + [2] * len(estados_cancelado) + [3],
+        dtype=np.int8
+    )
+    codes = df_estados_with_names['nombre'].astype(estados_dtype).cat.codes.to_numpy()
+    bucket = bucket_por_codigo[codes]
+    fecha_hora = df_estados_with_names['fecha_hora']
+    
+    # Key the aggregation on small int codes for servicio_id (-1 = missing id);
+    # codes are numbered in order of first appearance, so they index servicios
+    servicio_codes, servicios = pd.factorize(df_estados_with_names['servicio_id'])
+    sid_code = servicio_codes.astype(np.int32)
+    
+    # Polars runs the aggregation multi-threaded when it is installed, NumPy otherwise
+    if pl is not None:
+        aggregates = aggregate_service_states_polars(
+            sid_code, fecha_hora, df_estados_with_names['nombre'], bucket, servicios
+        )
+    else:
+        aggregates = aggregate_service_states(
+            sid_code, fecha_hora, df_estados_with_names['nombre'], bucket, servicios
+        )
+    
+    # Rows are ordered by service ID as in the original SQL
+    df_servicio = df_servicio.sort_values('servicio_id')
+    df_tipo_servicio = df_tipo_servicio[['tipo_servicio_id', 'nombre']].rename(columns={'nombre': 'tipo_servicio'})
+    df_tipo_servicio['tipo_servicio_id'] = downcast_key(df_tipo_servicio['tipo_servicio_id'])
+    now_ts = get_run_timestamp(config)
+    
+    fact_servicios = build_fact_servicios(df_servicio, aggregates, df_tipo_servicio, now_ts)
+    
+    logger.info("Generated %d rows for fact_servicios", len(fact_servicios))
+    
+    return fact_servicios
+
+def build_fact_servicios(df_servicio, aggregates, df_tipo_servicio, now_ts):
+    """
+    Build the fact_servicios rows from the services and their state aggregates
+    
+    Args:
+        df_servicio (DataFrame): servicio source rows
+        aggregates (DataFrame): State aggregates indexed by servicio_id
+        df_tipo_servicio (DataFrame): tipo_servicio_id to tipo_servicio lookup
+        now_ts (Timestamp): Audit timestamp for the run
+        
+    Returns:
+        DataFrame: Fact rows, one per service
+    """
+    df_servicio = df_servicio.assign(
+        fecha_hora_solicitud=safe_datetime_conversion(
+            df_servicio['fecha_solicitud'], 
+            df_servicio['hora_solicitud'], 
+            "servicio_fecha_hora_solicitud"
+        ),
+        fecha_hora_deseada=safe_datetime_conversion(
+            df_servicio['fecha_deseada'], 
+            df_servicio['hora_deseada'], 
+            "servicio_fecha_hora_deseada"
+        )
+    )
+    
+    # Start building the result dataframe with a single join on servicio_id
+    result = df_servicio.join(aggregates, on='servicio_id')
+    
+    # Add tipo_servicio information (on int32 keys)
+    result['tipo_servicio_id'] = downcast_key(result['tipo_servicio_id'])
     result = result.merge(
-        df_tipo_servicio[['tipo_servicio_id', 'nombre']].rename(columns={'nombre': 'tipo_servicio'}),
+        df_tipo_servicio,
         on='tipo_servicio_id', 
-        how='left'
+        how='left',
+        sort=False
     )
     
     # Build the final structure according to the original SQL
-    logger.info("Building final fact table structure...")
-    
-    fact_servicios = pd.DataFrame()
-    
-    # Basic IDs
-    fact_servicios['sk_servicio'] = pd.Series([None] * len(result))  # NULL as in SQL
-    fact_servicios['id_servicio_bdo'] = result['servicio_id']
-    fact_servicios['id_cliente_bdo'] = result['cliente_id']
-    fact_servicios['id_usuario_bdo'] = result['usuario_id']
-    fact_servicios['id_mensajero_principal_bdo'] = result['mensajero_id']
-    fact_servicios['id_mensajero_secundario_bdo'] = result['mensajero2_id']
-    fact_servicios['id_mensajero_terciario_bdo'] = result['mensajero3_id']
-    fact_servicios['id_direccion_origen_bdo'] = result['origen_id']
-    fact_servicios['id_direccion_destino_bdo'] = result['destino_id']
-    fact_servicios['id_tipopago_bdo'] = result['tipo_pago_id']
-    fact_servicios['id_tipovehiculo_bdo'] = result['tipo_vehiculo_id']
-    
-    # Time dimension keys (format YYYYMMDDHH) - MODIFICACIÓN: Solo horas, sin minutos
-    fact_servicios['id_tiempo_solicitud'] = format_datetime_for_key(result['fecha_hora_solicitud'])
-    fact_servicios['id_tiempo_deseado'] = format_datetime_for_key(result['fecha_hora_deseada'])
-    fact_servicios['id_tiempo_ultima_actualizacion'] = format_datetime_for_key(result['ultima_actualizacion'])
-    
-    # Service information
-    fact_servicios['estado_actual'] = result['estado_actual']
-    fact_servicios['tipo_servicio'] = result['tipo_servicio']
-    fact_servicios['descripcion_servicio'] = result['descripcion']
-    fact_servicios['nombre_solicitante'] = result['nombre_solicitante']
-    fact_servicios['nombre_recibe'] = result['nombre_recibe']
-    fact_servicios['telefono_recibe'] = result['telefono_recibe']
-    fact_servicios['descripcion_pago'] = result['descripcion_pago']
-    fact_servicios['flag_ida_y_regreso'] = result['ida_y_regreso']
-    fact_servicios['prioridad'] = result['prioridad']
-    fact_servicios['flag_multiples_origenes'] = result['multiples_origenes']
+    logger.debug("Building fact_servicios with %d rows", len(result))
     
     # Time calculations in minutes
-    logger.info("Calculating time metrics...")
     
     # Total service time (from request to last update)
-    fact_servicios['tiempo_total_servicio_minutos'] = (
-        (result['ultima_actualizacion'] - result['fecha_hora_solicitud']).dt.total_seconds() / 60
-    ).where(result['ultima_actualizacion'].notna())
+    tiempo_total_servicio_minutos = minutes_between(result['fecha_hora_solicitud'], result['ultima_actualizacion'])
     
     # Assignment time (from request to first assignment)
-    fact_servicios['tiempo_asignacion_minutos'] = (
-        (result['primera_asignacion'] - result['fecha_hora_solicitud']).dt.total_seconds() / 60
-    ).where(result['primera_asignacion'].notna())
+    tiempo_asignacion_minutos = minutes_between(result['fecha_hora_solicitud'], result['primera_asignacion'])
     
     # Delivery time (from assignment to completion)
-    fact_servicios['tiempo_entrega_minutos'] = (
-        (result['primera_completado'] - result['primera_asignacion']).dt.total_seconds() / 60
-    ).where(
-        (result['primera_completado'].notna()) & (result['primera_asignacion'].notna())
-    )
+    tiempo_entrega_minutos = minutes_between(result['primera_asignacion'], result['primera_completado'])
+    
+    # All columns are gathered first so pandas builds the frame in one go
+    # sk_servicio is left out: it is a SERIAL key the warehouse assigns on insert
+    fact_servicios = pd.DataFrame({
+        # Basic IDs
+        'id_servicio_bdo': result['servicio_id'],
+        'id_cliente_bdo': result['cliente_id'],
+        'id_usuario_bdo': result['usuario_id'],
+        'id_mensajero_principal_bdo': result['mensajero_id'],
+        'id_mensajero_secundario_bdo': result['mensajero2_id'],
+        'id_mensajero_terciario_bdo': result['mensajero3_id'],
+        'id_direccion_origen_bdo': result['origen_id'],
+        'id_direccion_destino_bdo': result['destino_id'],
+        'id_tipopago_bdo': result['tipo_pago_id'],
+        'id_tipovehiculo_bdo': result['tipo_vehiculo_id'],
+        
+        # Time dimension keys (format YYYYMMDDHH) - MODIFICACIÓN: Solo horas, sin minutos
+        'id_tiempo_solicitud': format_datetime_for_key(result['fecha_hora_solicitud']),
+        'id_tiempo_deseado': format_datetime_for_key(result['fecha_hora_deseada']),
+        'id_tiempo_ultima_actualizacion': format_datetime_for_key(result['ultima_actualizacion']),
+        
+        # Service information
+        'estado_actual': result['estado_actual'],
+        'tipo_servicio': result['tipo_servicio'],
+        'descripcion_servicio': result['descripcion'],
+        'nombre_solicitante': result['nombre_solicitante'],
+        'nombre_recibe': result['nombre_recibe'],
+        'telefono_recibe': result['telefono_recibe'],
+        'descripcion_pago': result['descripcion_pago'],
+        'flag_ida_y_regreso': result['ida_y_regreso'],
+        'prioridad': result['prioridad'],
+        'flag_multiples_origenes': result['multiples_origenes'],
+        
+        # Time metrics
+        'tiempo_total_servicio_minutos': tiempo_total_servicio_minutos,
+        'tiempo_asignacion_minutos': tiempo_asignacion_minutos,
+        'tiempo_entrega_minutos': tiempo_entrega_minutos,
+        
+        # Status flags
+        'flag_completado': result['flag_completado'].eq(True),
+        'flag_cancelado': result['flag_cancelado'].eq(True),
+        
+        # Audit information
+        'flag_activo': result['activo'],
+        'flag_es_prueba': result['es_prueba'],
+        'fecha_creacion': now_ts,
+        'fecha_ultima_modificacion': now_ts
+    }, copy=False)
+    
+    return fact_servicios.reset_index(drop=True)
+
+def aggregate_service_states(sid_code, fecha_hora, nombre, bucket, servicios):
+    """
+    Aggregate the state changes of each service with NumPy
     
-    # Status flags
-    fact_servicios['flag_completado'] = result['servicio_id'].isin(servicios_completados)
-    fact_servicios['flag_cancelado'] = result['servicio_id'].isin(servicios_cancelados)
+    The state changes are sorted by service once; every aggregate is then a
+    segmented reduction (ufunc.reduceat) over the contiguous rows of each
+    service, on the int64 nanosecond view of the timestamps.
     
-    # Audit information
-    fact_servicios['flag_activo'] = result['activo']
-    fact_servicios['flag_es_prueba'] = result['es_prueba']
-    fact_servicios['fecha_creacion'] = pd.Timestamp.now()
-    fact_servicios['fecha_ultima_modificacion'] = pd.Timestamp.now()
+    Args:
+        sid_code (ndarray): int32 servicio_id codes per state change (-1 = missing id)
+        fecha_hora (Series): Timestamp of each state change
+        nombre (Series): State name of each state change
+        bucket (ndarray): State bucket (0=asignacion, 1=completado, 2=cancelado, 3=otro)
+        servicios (Index): servicio_id for each code
+        
+    Returns:
+        DataFrame: Aggregates indexed by servicio_id
+    """
+    # State changes without a servicio_id are ignored; a stable sort keeps the
+    # input order within each service
+    filas = np.flatnonzero(sid_code >= 0)
+    filas = filas[np.argsort(sid_code[filas], kind='stable')]
+    sid = sid_code[filas]
+    fecha_ns = fecha_hora.to_numpy(dtype='datetime64[ns]').view(np.int64)[filas]
+    bucket = bucket[filas]
+    
+    nat = np.iinfo(np.int64).min  # NaT, which max() already ignores
+    sin_fecha = np.iinfo(np.int64).max  # stands in for NaT in min()
+    
+    inicio = np.flatnonzero(np.r_[True, sid[1:] != sid[:-1]]) if len(sid) else np.array([], dtype=np.intp)
+    
+    def reduce_segments(ufunc, values):
+        return ufunc.reduceat(values, inicio) if len(inicio) else values[:0]
+    
+    def first_in_bucket(bucket_id):
+        primera = reduce_segments(np.minimum, np.where((bucket == bucket_id) & (fecha_ns != nat), fecha_ns, sin_fecha))
+        return np.where(primera == sin_fecha, nat, primera).view('datetime64[ns]')
+    
+    ultima = reduce_segments(np.maximum, fecha_ns)
+    
+    # Current state: first row of each service whose timestamp equals its last update
+    grupo = np.cumsum(np.r_[False, sid[1:] != sid[:-1]]) if len(sid) else sid
+    candidatas = np.flatnonzero((fecha_ns == ultima[grupo]) & (fecha_ns != nat))
+    grupos_con_fecha, primera_candidata = np.unique(grupo[candidatas], return_index=True)
+    fila_estado = np.full(len(inicio), -1, dtype=np.intp)
+    fila_estado[grupos_con_fecha] = filas[candidatas[primera_candidata]]
+    nombres = np.append(nombre.to_numpy(dtype=object), None)
+    
+    return pd.DataFrame({
+        'ultima_actualizacion': ultima.view('datetime64[ns]'),
+        'primera_asignacion': first_in_bucket(0),
+        'primera_completado': first_in_bucket(1),
+        'flag_completado': reduce_segments(np.logical_or, bucket == 1),
+        'flag_cancelado': reduce_segments(np.logical_or, bucket == 2),
+        'estado_actual': nombres[fila_estado]
+    }, index=servicios[sid[inicio]])
+
+def aggregate_service_states_polars(sid_code, fecha_hora, nombre, bucket, servicios):
+    """
+    Aggregate the state changes of each service with Polars
     
-    # Sort by service ID as in original SQL
-    fact_servicios = fact_servicios.sort_values('id_servicio_bdo').reset_index(drop=True)
+    Same result as aggregate_service_states, computed in one multi-threaded
+    group_by. Used when polars is installed.
     
-    logger.info(f"Generated {len(fact_servicios)} rows for fact_servicios")
+    Args:
+        sid_code (ndarray): int32 servicio_id codes per state change (-1 = missing id)
+        fecha_hora (Series): Timestamp of each state change
+        nombre (Series): State name of each state change
+        bucket (ndarray): State bucket (0=asignacion, 1=completado, 2=cancelado, 3=otro)
+        servicios (Index): servicio_id for each code
+        
+    Returns:
+        DataFrame: Aggregates indexed by servicio_id
+    """
+    fecha = pl.col('fecha_hora')
+    aggregated = pl.DataFrame({
+        'sid_code': sid_code,
+        'fecha_hora': fecha_hora.to_numpy(),
+        'fila': np.arange(len(sid_code), dtype=np.int64),
+        'bucket': bucket
+    }).lazy().filter(pl.col('sid_code') >= 0).group_by('sid_code', maintain_order=True).agg(
+        fecha.max().alias('ultima_actualizacion'),
+        fecha.filter(pl.col('bucket') == 0).min().alias('primera_asignacion'),
+        fecha.filter(pl.col('bucket') == 1).min().alias('primera_completado'),
+        (pl.col('bucket') == 1).any().alias('flag_completado'),
+        (pl.col('bucket') == 2).any().alias('flag_cancelado'),
+        # Row of the current state; group rows keep their input order, so ties
+        # resolve to the first change. -1 when the service has no dated change
+        pl.col('fila').filter(fecha == fecha.max()).first().fill_null(-1).alias('fila_estado_actual')
+    ).collect()
+    
+    # Converted column by column so pyarrow is not needed
+    aggregates = pd.DataFrame(
+        {
+            column: aggregated[column].to_numpy()
+            for column in ('ultima_actualizacion', 'primera_asignacion', 'primera_completado',
+                           'flag_completado', 'flag_cancelado')
+        },
+        index=servicios[aggregated['sid_code'].to_numpy()]
+    )
+    nombres = np.append(nombre.to_numpy(dtype=object), None)
+    aggregates['estado_actual'] = nombres[aggregated['fila_estado_actual'].to_numpy()]
     
-    return fact_servicios
+    return aggregates
 
 def safe_datetime_conversion(fecha_series, hora_series, column_name="datetime"):
     """
-    Safely convert fecha and hora series to datetime with multiple fallback strategies
+    Safely combine fecha and hora series into datetime values
+    
+    The date and the time of day are parsed separately and added as
+    datetime64 + timedelta64, instead of concatenating both into strings
+    and parsing them row by row. Values that cannot be parsed become NaT.
     
     Args:
         fecha_series: pandas Series with date values
@@ -609,77 +1063,130 @@ def safe_datetime_conversion(fecha_series, hora_series, column_name="datetime"):
     Returns:
         pandas Series with datetime values
     """
-    logger.info(f"Converting {column_name} with {len(fecha_series)} records")
+    logger.debug("Converting %s with %d records", column_name, len(fecha_series))
     
-    # Combine fecha and hora into strings
-    datetime_strings = fecha_series.astype(str) + ' ' + hora_series.astype(str)
+    fecha = pd.to_datetime(fecha_series, errors='coerce', cache=True)
+    hora = time_to_timedelta(hora_series)
+    result = fecha + hora
     
-    # Strategy 1: Try with mixed format (most flexible)
-    try:
-        result = pd.to_datetime(datetime_strings, format='mixed', errors='raise')
-        logger.info(f"Successfully converted {column_name} using mixed format")
-        return result
-    except Exception as e1:
-        logger.warning(f"Mixed format failed for {column_name}: {str(e1)}")
+    # Log examples of values that were present but could not be converted
+    failed_mask = result.isna() & fecha_series.notna() & hora_series.notna()
+    failed_count = failed_mask.sum()
+    if failed_count > 0:
+        failed_examples = (
+            fecha_series[failed_mask].astype(str) + ' ' + hora_series[failed_mask].astype(str)
+        ).head(5).tolist()
+        logger.warning("%d %s values could not be converted, e.g. %s", failed_count, column_name, failed_examples)
     
-    # Strategy 2: Try with coerce (convert errors to NaT)
-    try:
-        result = pd.to_datetime(datetime_strings, errors='coerce')
-        failed_count = result.isna().sum()
-        success_count = len(result) - failed_count
-        logger.info(f"Coerce conversion for {column_name}: {success_count} successful, {failed_count} failed")
-        
-        # Log examples of failed conversions
-        if failed_count > 0:
-            failed_mask = result.isna()
-            failed_examples = datetime_strings[failed_mask].head(5).tolist()
-            logger.warning(f"Examples of failed {column_name} conversions: {failed_examples}")
-        
-        return result
-    except Exception as e2:
-        logger.warning(f"Coerce conversion failed for {column_name}: {str(e2)}")
+    return result
+
+def time_to_timedelta(hora_series):
+    """
+    Convert a series of times of day to timedeltas since midnight
     
-    # Strategy 3: Try to clean the data first
-    try:
-        logger.info(f"Attempting to clean {column_name} data before conversion")
+    Args:
+        hora_series: pandas Series with datetime.time, timedelta or string values
         
-        # Clean common issues
-        cleaned_strings = datetime_strings.str.replace(r'\.\d+$', '', regex=True)  # Remove microseconds
-        cleaned_strings = cleaned_strings.str.strip()  # Remove whitespace
+    Returns:
+        pandas Series with timedelta64 values (NaT where parsing failed)
+    """
+    if pd.api.types.is_timedelta64_dtype(hora_series):
+        return hora_series
+    
+    # Times of day repeat heavily, so only the distinct values are parsed.
+    # Missing values get code -1, which picks the trailing NaT
+    codes, uniques = pd.factorize(hora_series)
+    parsed = pd.to_timedelta(pd.Series(uniques).astype(str), errors='coerce').to_numpy()
+    parsed = np.append(parsed, np.timedelta64('NaT', 'ns'))
+    
+    return pd.Series(parsed[codes], index=hora_series.index, name=hora_series.name)
+
+def minutes_between(start_series, end_series):
+    """
+    Compute the minutes elapsed between two datetime series
+    
+    Minutes stay fractional because the warehouse columns are NUMERIC(10,2).
+    NaT on either side propagates through the subtraction, so missing
+    timestamps give NaN (NULL) without a separate mask.
+    
+    Args:
+        start_series: pandas Series with start datetimes
+        end_series: pandas Series with end datetimes
         
-        result = pd.to_datetime(cleaned_strings, errors='coerce')
-        failed_count = result.isna().sum()
-        success_count = len(result) - failed_count
-        logger.info(f"Cleaned conversion for {column_name}: {success_count} successful, {failed_count} failed")
+    Returns:
+        ndarray: float64 minutes (NaN where either datetime is missing)
+    """
+    delta = end_series.to_numpy(dtype='datetime64[ns]') - start_series.to_numpy(dtype='datetime64[ns]')
+    return delta / np.timedelta64(1, 'm')
+
+def downcast_key(key_series):
+    """
+    Narrow an integer join key to int32 when its values fit
+    
+    Merges hash and compare the key column, so a narrower key means less
+    memory traffic. Other dtypes (floats with NULLs, nullable or object
+    columns) are returned unchanged.
+    
+    Args:
+        key_series: pandas Series with the join key
         
-        return result
-    except Exception as e3:
-        logger.error(f"All conversion strategies failed for {column_name}: {str(e3)}")
+    Returns:
+        pandas Series with int32 values, or the original series
+    """
+    if not isinstance(key_series.dtype, np.dtype) or key_series.dtype.kind not in 'iu':
+        return key_series
+    
+    int32_info = np.iinfo(np.int32)
+    if key_series.empty or (key_series.min() >= int32_info.min and key_series.max() <= int32_info.max):
+        return key_series.astype(np.int32)
     
-    # Strategy 4: Last resort - return NaT series
-    logger.error(f"Returning NaT series for {column_name}")
-    return pd.Series([pd.NaT] * len(fecha_series), index=fecha_series.index)
+    return key_series
 
 def format_datetime_for_key(datetime_series, format_str='%Y%m%d%H'):
     """
-    Safely format datetime series to string keys, handling NaT values
+    Safely format datetime series to integer keys, handling NaT values
     MODIFICACIÓN: Cambiado el formato de '%Y%m%d%H%M' a '%Y%m%d%H' para solo mostrar horas
     
+    The default YYYYMMDDHH key is built with integer arithmetic on the
+    datetime64 values; other formats go through strftime.
+    
     Args:
         datetime_series: pandas Series with datetime values
         format_str: strftime format string (default: '%Y%m%d%H' - solo horas)
         
     Returns:
-        pandas Series with formatted strings (or None for NaT values)
+        pandas Series with Int64 keys (or <NA> for NaT values)
     """
     try:
-        # Handle NaT values by converting to None
-        result = datetime_series.dt.strftime(format_str)
-        # Convert empty strings back to None
-        result = result.where(result != '', None)
-        # Try to convert to Int64 (nullable integer)
-        return result.astype('Int64')
+        if format_str != '%Y%m%d%H':
+            # Handle NaT values by converting to None
+            result = datetime_series.dt.strftime(format_str)
+            # Convert empty strings back to None
+            result = result.where(result != '', None)
+            # Try to convert to Int64 (nullable integer)
+            return result.astype('Int64')
+        
+        horas = datetime_series.to_numpy(dtype='datetime64[h]')
+        meses = horas.astype('datetime64[M]')
+        
+        anio = meses.astype(np.int64) // 12 + 1970
+        mes = meses.astype(np.int64) % 12 + 1
+        dia = (horas.astype('datetime64[D]') - meses).astype(np.int64) + 1
+        hora = horas.astype(np.int64) % 24
+        
+        isnat = np.isnat(horas)
+        keys = np.where(isnat, 0, anio * 1_000_000 + mes * 10_000 + dia * 100 + hora)
+        return pd.Series(pd.arrays.IntegerArray(keys, isnat), index=datetime_series.index)
     except Exception as e:
-        logger.warning(f"Error formatting datetime series: {str(e)}")
+        logger.warning("Error formatting datetime series: %s", e)
         # Return None series as fallback
-        return pd.Series([None] * len(datetime_series), index=datetime_series.index, dtype='Int64')
\ No newline at end of file
+        return pd.Series([None] * len(datetime_series), index=datetime_series.index, dtype='Int64')
+
+# Specific transformation functions; tables without one use the generic SQL transformations
+_DIM_HANDLERS = {
+    'dimtiempo': transform_dimtiempo,
+}
+
+_FACT_HANDLERS = {
+    'fact_servicios': transform_fact_servicios,
+}
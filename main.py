@@ -36,7 +36,7 @@ def run_etl(config_dir="config"):
     """
     try:
         start_time = datetime.now()
-        logger.info(f"Starting ETL process at {start_time}")
+        logger.info("Starting ETL process at %s", start_time)
         
         # Load configuration
         logger.info("Loading configuration files")
@@ -45,7 +45,7 @@ def run_etl(config_dir="config"):
         # Extract data from source systems
         logger.info("Starting data extraction")
         extracted_data = extract_data(config)
-        logger.info(f"Extraction completed. Extracted {len(extracted_data)} datasets")
+        logger.info("Extraction completed. Extracted %d datasets", len(extracted_data))
         
         # Transform the extracted data
         logger.info("Starting data transformation")
@@ -60,14 +60,14 @@ def run_etl(config_dir="config"):
         # Log completion statistics
         end_time = datetime.now()
         duration = end_time - start_time
-        logger.info(f"ETL process completed successfully at {end_time}")
-        logger.info(f"Total duration: {duration}")
-        logger.info(f"Loaded {load_results['rows_loaded']} rows across {load_results['tables_loaded']} tables")
+        logger.info("ETL process completed successfully at %s", end_time)
+        logger.info("Total duration: %s", duration)
+        logger.info("Loaded %d rows across %d tables", load_results['rows_loaded'], load_results['tables_loaded'])
         
         return True
     
     except Exception as e:
-        logger.error(f"ETL process failed with error: {str(e)}", exc_info=True)
+        logger.error("ETL process failed with error: %s", e, exc_info=True)
         return False
 
 if __name__ == "__main__":